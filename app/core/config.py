@@ -22,6 +22,8 @@ class Settings(BaseSettings):
 
     # Limits & defaults
     MAX_CHARS: int = 3000
+    # اندازه‌ی thread pool اختصاصی pyttsx3 (به ازای هر worker uvicorn)
+    TTS_THREAD_POOL_SIZE: int = 8
     DEFAULT_ENGINE: str = "edge"
     DEFAULT_VOICE: str = "en-US-JennyNeural"
     DEFAULT_FORMAT: str = "mp3"
@@ -1,16 +1,19 @@
 from __future__ import annotations
+import asyncio
+import functools
 import hashlib
 import json
+import os
 import re
 import shutil
+import string
+import struct
+import subprocess
 import wave
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
-from mutagen import File as MutagenFile  # type: ignore
-from pydub import AudioSegment  # type: ignore
-
 from .config import settings
 from .logger import get_logger
 
@@ -18,6 +21,11 @@ log = get_logger("app.core.utils")
 
 _WHITESPACE_RE = re.compile(r"\s+", re.MULTILINE)
 
+# حذف ZWNJ + تبدیل whitespaceهای رایج به فاصله در یک پاس C-سطح
+_NORMALIZE_MAP = str.maketrans(
+    {"\u200c": None, "\t": " ", "\n": " ", "\r": " ", "\v": " ", "\f": " "}
+)
+
 
 @dataclass
 class CacheKey:
@@ -29,17 +37,20 @@ class CacheKey:
     filename: str
     rel_path: Path  # relative to AUDIO_DIR
     abs_path: Path  # absolute path on disk
+    audio_url: str  # precomputed /static/audio/... URL
 
 
 def normalize_text(text: str) -> str:
     """
     نرمال‌سازی فاصله‌ها و شکست خط‌ها (برای حالت non-SSML)
     """
-    if text is None:
+    if not text:
         return ""
-    text = text.replace("\u200c", "")  # ZWNJ
-    text = _WHITESPACE_RE.sub(" ", text)
-    return text.strip()
+    s = text.translate(_NORMALIZE_MAP)
+    # regex فقط وقتی لازم است که فاصله‌ی تکراری باقی مانده باشد (حالت نادر)
+    if "  " in s:
+        s = _WHITESPACE_RE.sub(" ", s)
+    return s.strip()
 
 
 def ensure_directories() -> None:
@@ -49,38 +60,103 @@ def ensure_directories() -> None:
     settings.AUDIO_DIR.mkdir(parents=True, exist_ok=True)
 
 
+class _SanitizeTable(dict):
+    # هر کاراکتری خارج از جدول (از جمله non-ASCII) به "-" نگاشت می‌شود
+    def __missing__(self, key: int) -> str:
+        return "-"
+
+
+_SANITIZE_MAP = _SanitizeTable(
+    {ord(c): c for c in string.ascii_letters + string.digits + "._-"}
+)
+
+
 def sanitize_basename(name: str) -> str:
     """
     نام فایل-safe (بدون پسوند)
     """
-    safe = re.sub(r"[^a-zA-Z0-9._-]", "-", name)
-    safe = re.sub(r"-+", "-", safe).strip("-._")
-    return safe or "audio"
+    safe = name.translate(_SANITIZE_MAP)
+    # جمع کردن "-"های پشت‌سرهم؛ نام فایل‌ها کوتاه‌اند و این حلقه عملاً ۰-۲ بار اجرا می‌شود
+    while "--" in safe:
+        safe = safe.replace("--", "-")
+    return safe.strip("-._") or "audio"
 
 
 def compute_cache_key(
     *, engine: str, voice: str, text: str, ssml: bool, rate: int, pitch: int, fmt: str
 ) -> CacheKey:
     """
-    SHA-256 پایدار از پارامترهای تاثیرگذار در خروجی.
+    هش پایدار (BLAKE2b-256) از پارامترهای تاثیرگذار در خروجی.
     مسیر: AUDIO_DIR / {first2}/{fullhex}.{ext}
     """
-    payload = {
-        "engine": engine,
-        "voice": voice or "",
-        "text": text or "",
-        "ssml": bool(ssml),
-        "rate": int(rate),
-        "pitch": int(pitch),
-        "format": fmt,
-    }
-    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
-    key_hex = hashlib.sha256(raw).hexdigest()
+    return _compute_cache_key_cached(engine, voice, text, ssml, rate, pitch, fmt)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compute_cache_key_cached(
+    engine: str, voice: str, text: str, ssml: bool, rate: int, pitch: int, fmt: str
+) -> CacheKey:
+    # درخواست‌های تکراری با payload یکسان، encode/هش مجدد را رد می‌کنند.
+    # فیلدها مستقیم و با tag/جداکننده به هش داده می‌شوند تا JSON encode حذف شود؛
+    # blake2b روی اکثر CPUها از SHA-256 سریع‌تر است و خروجی همچنان ۶۴ کاراکتر hex است.
+    h = hashlib.blake2b(digest_size=32)
+    h.update(b"E"); h.update(engine.encode("utf-8")); h.update(b"\0")
+    h.update(b"V"); h.update((voice or "").encode("utf-8")); h.update(b"\0")
+    h.update(b"S"); h.update(b"1" if ssml else b"0")
+    h.update(b"R"); h.update(int(rate).to_bytes(2, "little", signed=True))
+    h.update(b"P"); h.update(int(pitch).to_bytes(2, "little", signed=True))
+    h.update(b"F"); h.update(fmt.encode("utf-8")); h.update(b"\0")
+    h.update(b"T"); h.update((text or "").encode("utf-8"))
+    key_hex = h.hexdigest()
     subdir = key_hex[:2]
     filename = f"{key_hex}.{fmt}"
     rel_path = Path(subdir) / filename
     abs_path = settings.AUDIO_DIR / rel_path
-    return CacheKey(key_hex=key_hex, subdir=subdir, filename=filename, rel_path=rel_path, abs_path=abs_path)
+    # URL یک بار اینجا ساخته می‌شود (بدون as_posix در هر پاسخ)
+    return CacheKey(
+        key_hex=key_hex,
+        subdir=subdir,
+        filename=filename,
+        rel_path=rel_path,
+        abs_path=abs_path,
+        audio_url=f"/static/audio/{subdir}/{filename}",
+    )
+
+
+_AUDIO_EXTS = frozenset({"mp3", "ogg", "wav"})
+
+
+def parse_file_id(file_id: str) -> Optional[tuple[str, str]]:
+    """
+    پارس شناسه‌ی فایل به شکل <64hex>.<mp3|ogg|wav> و برگرداندن (hex, ext).
+    بدون regex: طول ثابت + bytes.fromhex (سطح C) از re.match سریع‌تر است
+    و ورودی‌های خراب را زودتر رد می‌کند.
+    """
+    if len(file_id) < 66 or file_id[64] != ".":
+        return None
+    hex_part, ext = file_id[:64], file_id[65:].lower()
+    if ext not in _AUDIO_EXTS:
+        return None
+    try:
+        bytes.fromhex(hex_part)
+    except ValueError:
+        return None
+    return hex_part.lower(), ext
+
+
+# زیرپوشه‌های hash فقط ۲۵۶ حالت دارند ({00..ff})؛ بعد از گرم شدن این set
+# دیگر هیچ syscall mkdir صادر نمی‌شود
+_MKDIR_SEEN: set = set()
+
+
+def ensure_cache_subdir(path: Path) -> None:
+    """
+    ساخت زیرپوشه‌ی کش (AUDIO_DIR/<first2>) حداکثر یک بار در هر پروسه.
+    """
+    key = path.as_posix()
+    if key not in _MKDIR_SEEN:
+        path.mkdir(parents=True, exist_ok=True)
+        _MKDIR_SEEN.add(key)
 
 
 def ensure_parent_dir(path: Path) -> None:
@@ -94,18 +170,115 @@ def audio_url_for(rel_path: Path) -> str:
     return f"/static/audio/{rel_path.as_posix()}"
 
 
+def _duration_sidecar_path(path: Path) -> Path:
+    return path.with_suffix(".json")
+
+
+def write_duration_sidecar(path: Path, duration: Optional[float]) -> None:
+    """
+    ذخیره‌ی مدت زمان کنار فایل صوتی (<hash>.json) تا در cache hit بعدی
+    نیازی به probe مجدد نباشد.
+    """
+    if duration is None:
+        return
+    try:
+        _duration_sidecar_path(path).write_text(
+            json.dumps({"duration": duration}), encoding="utf-8"
+        )
+    except OSError as e:
+        log.debug(f"could not write duration sidecar for {path}: {e}")
+
+
+def read_duration_sidecar(path: Path) -> Optional[float]:
+    """
+    خواندن مدت زمان از sidecar؛ اگر sidecar قدیمی‌تر از فایل صوتی باشد نادیده گرفته می‌شود.
+    """
+    sidecar = _duration_sidecar_path(path)
+    try:
+        if sidecar.stat().st_mtime_ns < path.stat().st_mtime_ns:
+            return None
+        data = json.loads(sidecar.read_text(encoding="utf-8"))
+        return float(data["duration"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _wav_duration_fast(path: Path) -> Optional[float]:
+    """
+    خواندن مستقیم ۴۴ بایت هدر RIFF به جای اسکن chunkها با ماژول wave.
+    فقط برای هدر canonical (chunk "data" در offset ۳۶) جواب می‌دهد؛
+    در غیر این صورت None تا مسیر wave معمول اجرا شود.
+    """
+    try:
+        with open(path, "rb") as f:
+            hdr = f.read(44)
+    except OSError:
+        return None
+    if len(hdr) < 44 or hdr[:4] != b"RIFF" or hdr[8:12] != b"WAVE" or hdr[36:40] != b"data":
+        return None
+    byte_rate = struct.unpack_from("<I", hdr, 28)[0]
+    data_size = struct.unpack_from("<I", hdr, 40)[0]
+    if not byte_rate:
+        return None
+    return data_size / byte_rate
+
+
+def _ffprobe_duration(path: Path) -> Optional[float]:
+    """
+    مدت زمان از metadata کانتینر با ffprobe — فقط هدر خوانده می‌شود،
+    نه کل استریم (probesize محدود)، پس از decode کامل بسیار ارزان‌تر است.
+    """
+    try:
+        out = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-probesize", "131072", "-analyzeduration", "500000",
+                "-show_entries", "format=duration",
+                "-of", "default=nw=1:nk=1",
+                path.as_posix(),
+            ],
+            capture_output=True, text=True, timeout=2,
+        )
+        return float(out.stdout.strip())
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
 def probe_duration_seconds(path: Path) -> Optional[float]:
+    """
+    مدت زمان فایل (با کش در سطح پروسه؛ کلید شامل mtime/size است تا
+    تغییر فایل روی دیسک کش را باطل کند).
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return _probe_duration_cached(path.as_posix(), st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _probe_duration_cached(path_str: str, mtime_ns: int, size: int) -> Optional[float]:
     """
     مدت زمان فایل: اول mutagen (MP3/OGG …)، اگر WAV بود از wave،
     در نهایت fallback با pydub (نیازمند ffmpeg برای بعضی فرمت‌ها).
     """
+    path = Path(path_str)
     try:
+        # import تنبل — mutagen فقط موقع probe لازم است، نه در استارتاپ
+        from mutagen import File as MutagenFile  # type: ignore
+
         mf = MutagenFile(path.as_posix())
         if mf is not None and mf.info is not None and getattr(mf.info, "length", None):
             return float(mf.info.length)
     except Exception as e:
         log.debug(f"mutagen probe failed for {path}: {e}")
 
+    if path.suffix.lower() == ".wav":
+        # هدر canonical: یک read ۴۴ بایتی به جای اسکن chunkها
+        dur = _wav_duration_fast(path)
+        if dur is not None:
+            return dur
+
     try:
         if path.suffix.lower() == ".wav":
             with wave.open(path.as_posix(), "rb") as w:
@@ -116,7 +289,14 @@ def probe_duration_seconds(path: Path) -> Optional[float]:
     except Exception as e:
         log.debug(f"wave probe failed for {path}: {e}")
 
+    # ffprobe فقط metadata را می‌خواند؛ خیلی ارزان‌تر از decode کامل pydub
+    dur = _ffprobe_duration(path)
+    if dur is not None:
+        return dur
+
     try:
+        from pydub import AudioSegment  # type: ignore
+
         seg = AudioSegment.from_file(path.as_posix())
         return round(len(seg) / 1000.0, 3)
     except Exception as e:
@@ -124,12 +304,35 @@ def probe_duration_seconds(path: Path) -> Optional[float]:
         return None
 
 
+# کدک صریح برای هر پسوند مقصد — از حدس ffmpeg جلوگیری می‌کند
+_FFMPEG_CODECS = {
+    ".mp3": ["-c:a", "libmp3lame"],
+    ".ogg": ["-c:a", "libvorbis"],
+    ".wav": ["-c:a", "pcm_s16le"],
+}
+
+
 def convert_audio(src: Path, dst: Path) -> bool:
     """
-    تبدیل فرمت با pydub/ffmpeg بر اساس پسوند مقصد.
+    تبدیل فرمت بر اساس پسوند مقصد؛ یک بار ffmpeg مستقیم (بدون عبور PCM از
+    پایتون)، و fallback با pydub اگر ffmpeg روی PATH نبود.
     """
+    ensure_parent_dir(dst)
+    if has_ffmpeg():
+        cmd = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-i", src.as_posix()]
+        cmd += _FFMPEG_CODECS.get(dst.suffix.lower(), [])
+        cmd.append(dst.as_posix())
+        try:
+            subprocess.run(cmd, check=True, capture_output=True)
+            return True
+        except (OSError, subprocess.SubprocessError) as e:
+            log.error(f"ffmpeg conversion failed {src} -> {dst}: {e}")
+            return False
+
+    # fallback: pydub (دو بار decode/encode و عبور PCM از حافظه)
     try:
-        ensure_parent_dir(dst)
+        from pydub import AudioSegment  # type: ignore
+
         audio = AudioSegment.from_file(src.as_posix())
         audio.export(dst.as_posix(), format=dst.suffix.lstrip("."))
         return True
@@ -138,7 +341,75 @@ def convert_audio(src: Path, dst: Path) -> bool:
         return False
 
 
+# -------------------------
+# coalescer تبدیل‌ها: درخواست‌های هم‌زمان convert هر ~۵۰ms یک‌جا drain و
+# به صورت subprocessهای موازی ffmpeg (محدود به تعداد هسته) اجرا می‌شوند؛
+# fork cost بین درخواست‌ها سرشکن می‌شود و صف executor اشغال نمی‌ماند
+# -------------------------
+_CONVERT_BATCH_WINDOW_SEC = 0.05
+_CONVERT_BATCH_MAX = 8
+_CONVERT_QUEUE: Optional[asyncio.Queue] = None
+_CONVERT_SEM: Optional[asyncio.Semaphore] = None
+
+
+async def convert_audio_batched(src: Path, dst: Path) -> bool:
+    """
+    نسخه‌ی async convert_audio — درخواست در صف می‌نشیند و با بقیه‌ی
+    درخواست‌های پنجره‌ی جاری موازی اجرا می‌شود.
+    """
+    global _CONVERT_QUEUE, _CONVERT_SEM
+    loop = asyncio.get_running_loop()
+    if _CONVERT_QUEUE is None:
+        _CONVERT_QUEUE = asyncio.Queue()
+        _CONVERT_SEM = asyncio.Semaphore(os.cpu_count() or 2)
+        loop.create_task(_convert_drainer())
+    fut: asyncio.Future = loop.create_future()
+    await _CONVERT_QUEUE.put((src, dst, fut))
+    return await fut
+
+
+async def _convert_drainer() -> None:
+    while True:
+        batch = [await _CONVERT_QUEUE.get()]
+        await asyncio.sleep(_CONVERT_BATCH_WINDOW_SEC)
+        while len(batch) < _CONVERT_BATCH_MAX:
+            try:
+                batch.append(_CONVERT_QUEUE.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        loop = asyncio.get_running_loop()
+        for src, dst, fut in batch:
+            loop.create_task(_convert_one(src, dst, fut))
+
+
+async def _convert_one(src: Path, dst: Path, fut: asyncio.Future) -> None:
+    async with _CONVERT_SEM:
+        if has_ffmpeg():
+            ensure_parent_dir(dst)
+            cmd = ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-i", src.as_posix()]
+            cmd += _FFMPEG_CODECS.get(dst.suffix.lower(), [])
+            cmd.append(dst.as_posix())
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+                )
+                _, err = await proc.communicate()
+                ok = proc.returncode == 0
+                if not ok:
+                    log.error(f"ffmpeg conversion failed {src} -> {dst}: {err.decode('utf-8', 'ignore').strip()}")
+            except OSError as e:
+                log.error(f"ffmpeg conversion failed {src} -> {dst}: {e}")
+                ok = False
+        else:
+            # بدون ffmpeg: همان مسیر sync (pydub) در thread
+            ok = await asyncio.to_thread(convert_audio, src, dst)
+        if not fut.done():
+            fut.set_result(ok)
+
+
+@functools.lru_cache(maxsize=1)
 def has_ffmpeg() -> bool:
+    # PATH در طول عمر پروسه عوض نمی‌شود؛ نتیجه یک بار محاسبه می‌شود
     return shutil.which("ffmpeg") is not None
 
 
@@ -1,16 +1,17 @@
 from __future__ import annotations
-import re
+import hashlib
+import os
+import time
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 from .core.config import settings
 from .core.logger import get_logger
-from .core.utils import ensure_directories
+from .core.utils import ensure_directories, parse_file_id
 from .routers.meta import router as meta_router
 from .routers.tts import router as tts_router
 
@@ -18,14 +19,37 @@ log = get_logger("app.main")
 
 app = FastAPI(title=settings.APP_NAME)
 
-# (اختیاری) CORS — اگر لازم شد، دامنه‌های فرانت جدا را اضافه کنید
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # برای دپلوی واقعی محدودش کنید
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# (اختیاری) CORS — نسخه‌ی سبک wildcard؛ برخلاف CORSMiddleware استارلت،
+# هیچ تطبیق Origin/Method/Header به ازای هر درخواست انجام نمی‌دهد
+# (برای دپلوی واقعی با origin مشخص، به CORSMiddleware برگردید)
+class FastCORS:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["method"] == "OPTIONS":
+            # preflight حداقلی
+            headers = [
+                (b"access-control-allow-origin", b"*"),
+                (b"access-control-allow-methods", b"*"),
+                (b"access-control-allow-headers", b"*"),
+                (b"access-control-max-age", b"600"),
+            ]
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                msg["headers"].append((b"access-control-allow-origin", b"*"))
+            await send(msg)
+
+        await self.app(scope, receive, _send)
+
+
+app.add_middleware(FastCORS)
 
 # سرو فایل‌های استاتیک
 static_dir = Path(__file__).parent / "static"
@@ -43,38 +67,69 @@ async def on_startup():
     log.info(f"Audio dir is {settings.AUDIO_DIR}")
 
 
-# صفحهٔ اصلی — همان SPA را سرو می‌کند
+# صفحهٔ اصلی — همان SPA، ولی از حافظه سرو می‌شود (نه read از دیسک در هر hit)
+# هر چند ثانیه mtime چک می‌شود تا ادیت فایل در dev بدون ری‌استارت دیده شود
+_INDEX_RECHECK_SEC = 5.0
+_INDEX_CACHE: dict = {"bytes": None, "etag": None, "mtime_ns": 0, "checked": 0.0}
+
+
+def _get_index() -> Optional[tuple]:
+    now = time.monotonic()
+    if _INDEX_CACHE["bytes"] is None or (now - _INDEX_CACHE["checked"]) > _INDEX_RECHECK_SEC:
+        index_path = static_dir / "index.html"
+        try:
+            st = index_path.stat()
+            if st.st_mtime_ns != _INDEX_CACHE["mtime_ns"]:
+                data = index_path.read_bytes()
+                _INDEX_CACHE["bytes"] = data
+                _INDEX_CACHE["etag"] = f'"{hashlib.blake2b(data, digest_size=8).hexdigest()}"'
+                _INDEX_CACHE["mtime_ns"] = st.st_mtime_ns
+        except OSError:
+            _INDEX_CACHE["bytes"] = None
+        _INDEX_CACHE["checked"] = now
+    if _INDEX_CACHE["bytes"] is None:
+        return None
+    return _INDEX_CACHE["bytes"], _INDEX_CACHE["etag"]
+
+
 @app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def index():
-    index_path = static_dir / "index.html"
-    if not index_path.exists():
+async def index(request: Request):
+    cached = _get_index()
+    if cached is None:
         return HTMLResponse("<h1>Static UI not found</h1>", status_code=404)
-    return HTMLResponse(index_path.read_text(encoding="utf-8"))
+    body, etag = cached
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(
+        body,
+        media_type="text/html",
+        headers={"ETag": etag, "Cache-Control": "public, max-age=60"},
+    )
 
 
 # (اختیاری) دانلود با Content-Disposition: attachment
-# ورودی: شناسه‌ی فایل به صورت <sha256>.<ext>  (مثلاً 7bf2...c9.mp3)
-# فایل واقعی در app/static/audio/<first2>/<sha256>.<ext> ذخیره شده است
-_FILE_ID_RE = re.compile(r"^(?P<hex>[0-9a-fA-F]{64})\.(?P<ext>mp3|ogg|wav)$")
-
-
+# ورودی: شناسه‌ی فایل به صورت <hash>.<ext>  (مثلاً 7bf2...c9.mp3)
+# فایل واقعی در app/static/audio/<first2>/<hash>.<ext> ذخیره شده است
 @app.get("/download/{file_id}", include_in_schema=False)
 async def download(file_id: str):
-    m = _FILE_ID_RE.match(file_id)
-    if not m:
+    parsed = parse_file_id(file_id)
+    if parsed is None:
         raise HTTPException(status_code=400, detail="Invalid file id.")
-    hex_id = m.group("hex").lower()
-    ext = m.group("ext").lower()
+    hex_id, ext = parsed
     rel = Path(hex_id[:2]) / f"{hex_id}.{ext}"
     path = settings.AUDIO_DIR / rel
-    if not path.exists():
+    try:
+        stat_result = os.stat(path)
+    except OSError:
         raise HTTPException(status_code=404, detail="File not found.")
 
+    # stat از قبل انجام شده؛ پاس دادنش باعث می‌شود Starlette دوباره stat نزند
     return FileResponse(
         path.as_posix(),
         media_type=f"audio/{'mpeg' if ext=='mp3' else ext}",
         filename=f"{hex_id}.{ext}",
         headers={"Content-Disposition": f'attachment; filename="{hex_id}.{ext}"'},
+        stat_result=stat_result,
     )
 
 
@@ -1,9 +1,12 @@
 from __future__ import annotations
+import asyncio
+import os
 import tempfile
 from pathlib import Path
-from typing import Literal, Optional, Dict, Any
+from typing import Literal, Optional
 
 from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from ..core.config import settings
@@ -11,29 +14,27 @@ from ..core.logger import get_logger
 from ..core.utils import (
     clamp,
     compute_cache_key,
-    ensure_directories,
+    ensure_cache_subdir,
     normalize_text,
     audio_url_for,
+    parse_file_id,
     probe_duration_seconds,
-    convert_audio,
+    read_duration_sidecar,
+    write_duration_sidecar,
+    convert_audio_batched,
     validate_text_length,
     has_ffmpeg,
 )
-from ..services.tts_edge import EdgeTTSEngine
-from ..services.tts_pyttsx3 import Pyttsx3Engine
+from ..services.registry import ENGINE_NAMES, get_engine
 from aiohttp import ClientConnectorError, WSServerHandshakeError
 
 log = get_logger("app.routers.tts")
 router = APIRouter(tags=["tts"])
 
-# رجیستری موتورها
-ENGINES: Dict[str, Any] = {
-    "edge": EdgeTTSEngine(),
-    "pyttsx3": Pyttsx3Engine(),
-}
-
 SUPPORTED_FORMATS = {"mp3", "ogg", "wav"}
 
+_MEDIA_TYPES = {"mp3": "audio/mpeg", "ogg": "audio/ogg", "wav": "audio/wav"}
+
 
 # -------------------------
 # مدل‌های ورودی/خروجی
@@ -57,6 +58,7 @@ class TTSRequest(BaseModel):
 
 class TTSResponse(BaseModel):
     audio_url: str
+    stream_url: str  # دریافت مستقیم بایت‌ها از /tts/file/... بدون hop دوم StaticFiles
     duration: Optional[float]
     engine: str
     voice: str
@@ -67,19 +69,30 @@ class TTSResponse(BaseModel):
 # -------------------------
 # ابزار ساده rate-limit در حافظه (اختیاری)
 # -------------------------
+from collections import OrderedDict, deque
 from time import monotonic
 
-_RATE_BUCKET: Dict[str, list] = {}
+# LRU دستی با سقف تعداد IP — بدون سقف، هر IP یکتا (یا LB ابری) یک entry
+# دائمی اضافه می‌کند و حافظه در طول روزها uptime نشت می‌کند
+_RATE_BUCKET: "OrderedDict[str, deque]" = OrderedDict()
+_RATE_BUCKET_MAX_IPS = 10_000
 MAX_REQ_PER_MIN = 30
 WINDOW_SEC = 60
 
 
 def _rate_limit_ok(ip: str) -> bool:
     now = monotonic()
-    bucket = _RATE_BUCKET.setdefault(ip, [])
-    # دورریز قدیمی‌ها
+    bucket = _RATE_BUCKET.get(ip)
+    if bucket is None:
+        bucket = deque()
+        _RATE_BUCKET[ip] = bucket
+        if len(_RATE_BUCKET) > _RATE_BUCKET_MAX_IPS:
+            _RATE_BUCKET.popitem(last=False)  # بیرون انداختن قدیمی‌ترین IP
+    else:
+        _RATE_BUCKET.move_to_end(ip)
+    # دورریز قدیمی‌ها — popleft روی deque برخلاف list.pop(0) هزینه O(1) دارد
     while bucket and (now - bucket[0] > WINDOW_SEC):
-        bucket.pop(0)
+        bucket.popleft()
     if len(bucket) >= MAX_REQ_PER_MIN:
         return False
     bucket.append(now)
@@ -105,33 +118,37 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
         raise HTTPException(status_code=400, detail=str(ve))
 
     engine_name = payload.engine
-    if engine_name not in ENGINES:
+    if engine_name not in ENGINE_NAMES:
         raise HTTPException(status_code=400, detail="Unsupported engine.")
-    engine = ENGINES[engine_name]
+    engine = get_engine(engine_name)
 
     # clamp کردن rate/pitch به محدوده‌های پیکربندی
     rate = clamp(payload.rate, settings.RATE_MIN, settings.RATE_MAX)
     pitch = clamp(payload.pitch, settings.PITCH_MIN, settings.PITCH_MAX)
-    text_for_hash = payload.text if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text)
+    # متن مؤثر فقط یک بار محاسبه می‌شود (هم برای هش، هم برای سنتز)
+    eff_text = payload.text if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text)
 
     # محاسبه کلید کش و مسیر خروجی
     ck = compute_cache_key(
         engine=engine_name,
         voice=payload.voice or "",
-        text=text_for_hash,
+        text=eff_text,
         ssml=payload.ssml,
         rate=rate,
         pitch=pitch,
         fmt=payload.format,
     )
 
-    ensure_directories()
-
     # اگر کش موجود است، پاسخ سریع بده
     if settings.CACHE_ENABLED and ck.abs_path.exists():
-        duration = probe_duration_seconds(ck.abs_path)
+        # اول sidecar؛ اگر نبود یک بار probe و برای دفعات بعد ذخیره می‌کنیم
+        duration = read_duration_sidecar(ck.abs_path)
+        if duration is None:
+            duration = await asyncio.to_thread(probe_duration_seconds, ck.abs_path)
+            write_duration_sidecar(ck.abs_path, duration)
         return TTSResponse(
-            audio_url=audio_url_for(ck.rel_path),
+            audio_url=ck.audio_url,
+            stream_url=f"/tts/file/{ck.filename}",
             duration=duration,
             engine=engine_name,
             voice=payload.voice or "",
@@ -145,9 +162,9 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
     try:
         if engine_name == "edge":
             tmp_out = ck.abs_path if payload.format == "mp3" else ck.abs_path.with_suffix(".mp3")
-            tmp_out.parent.mkdir(parents=True, exist_ok=True)
+            ensure_cache_subdir(tmp_out.parent)
             await engine.synthesize(
-                text=text_for_hash if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text),
+                text=eff_text,
                 voice=payload.voice or settings.DEFAULT_VOICE,
                 rate=rate, pitch=pitch, fmt="mp3", ssml=payload.ssml, out_path=tmp_out,
             )
@@ -155,7 +172,7 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
             if payload.format in {"ogg", "wav"}:
                 if not has_ffmpeg():
                     raise HTTPException(status_code=500, detail="ffmpeg is required to convert to requested format.")
-                if not convert_audio(tmp_out, ck.abs_path):
+                if not await convert_audio_batched(tmp_out, ck.abs_path):
                     raise HTTPException(status_code=500, detail="Audio conversion failed.")
                 if ck.abs_path != tmp_out and tmp_out.exists():
                     try: tmp_out.unlink()
@@ -163,61 +180,38 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
                 final_path = ck.abs_path
 
         elif engine_name == "pyttsx3":
-            # تولید WAV سپس تبدیل به فرمت خواسته‌شده
-            tmp_wav = ck.abs_path if payload.format == "wav" else ck.abs_path.with_suffix(".wav")
-            tmp_wav.parent.mkdir(parents=True, exist_ok=True)
-
-            # برخی pyttsx3 نصب‌ها voice را قبول نمی‌کنند؛ خطا را مدیریت می‌کنیم
-            await engine.synthesize(
-                text=text_for_hash if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text),
+            # تبدیل فرمت داخل خود موتور انجام می‌شود (pipe فیوزشده‌ی
+            # espeak→ffmpeg، انکود lameenc داخل پروسه یا ffmpeg async) —
+            # WAV میانی و تبدیل دوباره در روتر لازم نیست
+            ensure_cache_subdir(ck.abs_path.parent)
+            final_path = await engine.synthesize(
+                text=eff_text,
                 voice=payload.voice or "",  # اگر خالی باشد، پیش‌فرض pyttsx3 استفاده می‌شود
                 rate=rate,
                 pitch=pitch,
-                fmt="wav",
+                fmt=payload.format,
                 ssml=payload.ssml,
-                out_path=tmp_wav,
+                out_path=ck.abs_path,
             )
-
-            final_path = tmp_wav
-            if payload.format in {"mp3", "ogg"}:
-                if not has_ffmpeg():
-                    raise HTTPException(status_code=500, detail="ffmpeg is required to convert to requested format.")
-                if not convert_audio(tmp_wav, ck.abs_path):
-                    raise HTTPException(status_code=500, detail="Audio conversion failed.")
-                final_path = ck.abs_path
-                # WAV موقت را حذف کنیم اگر مقصد متفاوت است
-                if final_path != tmp_wav and tmp_wav.exists():
-                    try:
-                        tmp_wav.unlink()
-                    except Exception:
-                        pass
         else:
             raise HTTPException(status_code=400, detail="Unsupported engine.")
 
     except (WSServerHandshakeError, ClientConnectorError) as e:
         # Auto-fallback to offline pyttsx3
         log.error(f"edge-tts failed with network/handshake error, falling back to pyttsx3: {e}")
-        engine_fallback = ENGINES["pyttsx3"]
+        engine_fallback = get_engine("pyttsx3")
         try:
-            tmp_wav = ck.abs_path if payload.format == "wav" else ck.abs_path.with_suffix(".wav")
-            tmp_wav.parent.mkdir(parents=True, exist_ok=True)
-            await engine_fallback.synthesize(
-                text=text_for_hash if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text),
-                voice=payload.voice or "", rate=rate, pitch=pitch, fmt="wav", ssml=payload.ssml, out_path=tmp_wav,
+            ensure_cache_subdir(ck.abs_path.parent)
+            final_path = await engine_fallback.synthesize(
+                text=eff_text,
+                voice=payload.voice or "", rate=rate, pitch=pitch,
+                fmt=payload.format, ssml=payload.ssml, out_path=ck.abs_path,
             )
         except RuntimeError as e2:
-            # pyttsx3 unavailable on this host -> clean 503
-            raise HTTPException(status_code=503, detail="Offline engine (pyttsx3) is not available on this host. Install espeak-ng or switch to edge.") from e2
-        final_path = tmp_wav
-        if payload.format in {"mp3", "ogg"}:
-            if not has_ffmpeg():
-                raise HTTPException(status_code=500, detail="ffmpeg is required to convert to requested format.")
-            if not convert_audio(tmp_wav, ck.abs_path):
-                raise HTTPException(status_code=500, detail="Audio conversion failed.")
-            final_path = ck.abs_path
-            if final_path != tmp_wav and tmp_wav.exists():
-                try: tmp_wav.unlink()
-                except Exception: pass
+            # pyttsx3 unavailable on this host -> clean 503؛ خطای تبدیل -> 500
+            if "unavailable" in str(e2):
+                raise HTTPException(status_code=503, detail="Offline engine (pyttsx3) is not available on this host. Install espeak-ng or switch to edge.") from e2
+            raise HTTPException(status_code=500, detail=str(e2)) from e2
         # Important: reflect engine used in response
         engine_name = "pyttsx3"
         
@@ -227,9 +221,11 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
         log.error(f"TTS synthesis failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Synthesis failed.")
 
-    duration = probe_duration_seconds(final_path)
+    duration = await asyncio.to_thread(probe_duration_seconds, final_path)
+    write_duration_sidecar(final_path, duration)
     return TTSResponse(
         audio_url=audio_url_for(final_path.relative_to(settings.AUDIO_DIR)),
+        stream_url=f"/tts/file/{final_path.name}",
         duration=duration,
         engine=engine_name,
         voice=payload.voice or "",
@@ -238,6 +234,66 @@ async def tts_endpoint(req: Request, payload: TTSRequest):
     )
 
 
+# -------------------------
+# Endpoint: GET /tts/file/{file_id}
+# دریافت مستقیم خروجی کش‌شده — بدون رفت‌وبرگشت دوم از مسیر /static
+# -------------------------
+@router.get("/tts/file/{file_id}")
+async def tts_file(file_id: str):
+    parsed = parse_file_id(file_id)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail="Invalid file id.")
+    hex_id, ext = parsed
+    path = settings.AUDIO_DIR / hex_id[:2] / f"{hex_id}.{ext}"
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="File not found.")
+    return FileResponse(
+        path.as_posix(),
+        media_type=_MEDIA_TYPES[ext],
+        stat_result=stat_result,
+    )
+
+
+# -------------------------
+# Endpoint: POST /tts/stream
+# خروجی مستقیم از pipe موتور آفلاین به پاسخ HTTP — بدون نوشتن روی دیسک
+# (کش نمی‌شود؛ برای پیش‌نمایش/پخش فوری. خروجی ماندگار از POST /tts بگیرید)
+# -------------------------
+@router.post("/tts/stream")
+async def tts_stream(req: Request, payload: TTSRequest):
+    client_ip = req.client.host if req.client else "unknown"
+    if not _rate_limit_ok(client_ip):
+        raise HTTPException(status_code=429, detail="Too many requests, please slow down.")
+    try:
+        validate_text_length(payload.text)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    rate = clamp(payload.rate, settings.RATE_MIN, settings.RATE_MAX)
+    eff_text = payload.text if payload.ssml else (normalize_text(payload.text) if payload.normalize else payload.text)
+
+    engine = get_engine("pyttsx3")  # استریم فقط از مسیر espeak-ng ممکن است
+    stream = engine.synthesize_to_stream(eff_text, payload.voice or "", rate, payload.format)
+    # تکه‌ی اول را قبل از شروع پاسخ می‌گیریم تا خطای راه‌اندازی subprocess
+    # به جای قطع وسط stream، یک HTTP error تمیز شود
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def body():
+        if first:
+            yield first
+        async for chunk in stream:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=_MEDIA_TYPES[payload.format])
+
+
 # -------------------------
 # Endpoint: POST /tts/ssml (میانبر)
 # -------------------------
@@ -0,0 +1,22 @@
+# app/services/registry.py
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any
+
+# نام موتورهای شناخته‌شده — برای چک عضویت در روترها
+ENGINE_NAMES = ("edge", "pyttsx3")
+
+
+@lru_cache(maxsize=None)
+def get_engine(name: str) -> Any:
+    """
+    رجیستری تنبل و یکتا: هر موتور حداکثر یک بار ساخته می‌شود و ماژول سنگینش
+    (edge_tts / pyttsx3) تا اولین استفاده اصلاً import نمی‌شود.
+    """
+    if name == "edge":
+        from .tts_edge import EdgeTTSEngine
+        return EdgeTTSEngine()
+    if name == "pyttsx3":
+        from .tts_pyttsx3 import Pyttsx3Engine
+        return Pyttsx3Engine()
+    raise KeyError(name)
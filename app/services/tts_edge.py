@@ -1,34 +1,58 @@
 # app/services/tts_edge.py
 import asyncio
 import json
+import os
+import time
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-import edge_tts
 from aiohttp import ClientConnectorError, WSServerHandshakeError  # add
 
+# edge_tts به صورت تنبل داخل متدها import می‌شود تا استارتاپ سبک بماند
+
 from ..core.logger import get_logger
 from ..core.utils import ensure_parent_dir, probe_duration_seconds
 
 log = get_logger("app.services.tts_edge")
 
+# کش کاتالوگ صداها — کاتالوگ Azure به ندرت عوض می‌شود، پس یک ساعت TTL کافی است
+_VOICES_TTL_SEC = 3600.0
+_VOICES_CACHE: Dict[str, Any] = {"data": None, "expires": 0.0}
+_VOICES_LOCK = asyncio.Lock()
+
+
 class EdgeTTSEngine:
     name = "edge"
 
     async def list_voices(self) -> List[Dict[str, Any]]:
-        try:
-            voices = await edge_tts.list_voices()
-            return [
-                {
-                    "id": v["ShortName"],
-                    "name": v["FriendlyName"],
-                    "locale": v["Locale"],
-                    "gender": v["Gender"].lower(),
-                }
-                for v in voices
-            ]
-        except Exception as e:
-            log.error(f"edge-tts voice listing failed: {e}")
-            return []
+        now = time.monotonic()
+        if _VOICES_CACHE["data"] is not None and now < _VOICES_CACHE["expires"]:
+            return _VOICES_CACHE["data"]
+
+        # single-flight: refreshهای همزمان فقط یک بار به Azure می‌روند
+        async with _VOICES_LOCK:
+            now = time.monotonic()
+            if _VOICES_CACHE["data"] is not None and now < _VOICES_CACHE["expires"]:
+                return _VOICES_CACHE["data"]
+            try:
+                import edge_tts
+
+                voices = await edge_tts.list_voices()
+                shaped = [
+                    {
+                        "id": v["ShortName"],
+                        "name": v["FriendlyName"],
+                        "locale": v["Locale"],
+                        "gender": v["Gender"].lower(),
+                    }
+                    for v in voices
+                ]
+                _VOICES_CACHE["data"] = shaped
+                _VOICES_CACHE["expires"] = now + _VOICES_TTL_SEC
+                return shaped
+            except Exception as e:
+                log.error(f"edge-tts voice listing failed: {e}")
+                # لیست کهنه بهتر از لیست خالی است
+                return _VOICES_CACHE["data"] or []
 
     async def synthesize(
         self,
@@ -41,10 +65,6 @@ class EdgeTTSEngine:
         out_path: Optional[Path] = None,
     ) -> Path:
         ensure_parent_dir(out_path)
-        # overwrite if exists (avoid append)
-        if out_path and out_path.exists():
-            try: out_path.unlink()
-            except Exception: pass
 
         # UA tweak to avoid some 403s (see issues)
         headers = {
@@ -56,13 +76,29 @@ class EdgeTTSEngine:
         }
 
         try:
+            import edge_tts
+
             rate_str = f"{rate:+d}%" if rate else "0%"
             pitch_str = f"{pitch:+d}Hz" if pitch else "0Hz"
             communicate = edge_tts.Communicate(text, voice=voice, rate=rate_str, pitch=pitch_str, headers=headers)
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio" and out_path:
-                    with open(out_path, "ab") as f:
-                        f.write(chunk["data"])
+            # یک بار open به جای open/close به ازای هر chunk؛ بافر بزرگ‌تر
+            # باعث می‌شود chunkهای کوچک edge-tts در writeهای بزرگ‌تر جمع شوند.
+            # روی نام موقت می‌نویسیم و در پایان rename می‌کنیم — out_path مسیر
+            # کش است و شکست قبل از اولین chunk نباید فایل صفر بایتی جا بگذارد
+            # که درخواست‌های بعدی cached=True با صدای خالی بگیرند
+            tmp_path = out_path.with_name(out_path.name + ".part")
+            try:
+                with open(tmp_path, "wb", buffering=64 * 1024) as f:
+                    async for chunk in communicate.stream():
+                        if chunk["type"] == "audio":
+                            f.write(chunk["data"])
+                os.replace(tmp_path, out_path)
+            except BaseException:
+                try:
+                    tmp_path.unlink()
+                except OSError:
+                    pass
+                raise
             return out_path
         except (WSServerHandshakeError, ClientConnectorError) as e:
             log.error(f"edge-tts synthesis failed: {e}")
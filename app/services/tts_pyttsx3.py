@@ -1,22 +1,94 @@
 # app/services/tts_pyttsx3.py
 from __future__ import annotations
 import asyncio
+import hashlib
+import operator
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import wave
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional
 
 import pyttsx3  # type: ignore
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 
+from ..core.config import settings
 from ..core.logger import get_logger
 from ..core.utils import (
     ensure_parent_dir,
     probe_duration_seconds,
-    convert_audio,
+    read_duration_sidecar,
+    write_duration_sidecar,
     has_ffmpeg,
 )
 
 log = get_logger("app.services.tts_pyttsx3")
 
+# کش نتیجه در سطح موتور — خروجی نهایی با کلید (text, voice, rate, fmt)
+# ذخیره می‌شود تا درخواست‌های تکراری نه espeak بخورند نه ffmpeg
+_RESULT_CACHE_DIRNAME = "_pyttsx3_cache"
+_RESULT_CACHE_MAX_ENTRIES = 256
+
+# espeak-ng حدود ۱۷۵ کلمه در دقیقه به صورت پیش‌فرض می‌خواند
+_ESPEAK_BASE_WPM = 175
+
+# بعد از این تعداد سنتز، موتور thread-local بازسازی می‌شود — بعضی driverها
+# (sapi5/nsss و حتی espeak) handle یا COM reference نشت می‌دهند و در
+# workerهای طولانی‌عمر uvicorn جمع می‌شوند
+_ENGINE_RECYCLE_AFTER = 1000
+_PIPE_BUFSIZE = 1 << 20
+
+
+@lru_cache(maxsize=1)
+def _espeak_bin() -> Optional[str]:
+    return shutil.which("espeak-ng")
+
+
+@lru_cache(maxsize=1)
+def _lameenc_mod():
+    # وابستگی اختیاری: انکود MP3 داخل پروسه به جای fork کردن ffmpeg
+    try:
+        import lameenc  # type: ignore
+        return lameenc
+    except ImportError:
+        return None
+
+
+def _wav_to_mp3_inproc(wav_path: Path, mp3_path: Path) -> bool:
+    """
+    WAV→MP3 با بایندینگ LAME، بدون subprocess. برای خروجی‌های کوتاه
+    (زیر یک ثانیه) هزینه‌ی fork+exec خود ffmpeg از انکود بزرگ‌تر است.
+    """
+    lame = _lameenc_mod()
+    if lame is None:
+        return False
+    try:
+        with wave.open(wav_path.as_posix(), "rb") as w:
+            sample_rate = w.getframerate()
+            channels = w.getnchannels()
+            frames = w.readframes(w.getnframes())
+        enc = lame.Encoder()
+        enc.set_bit_rate(128)
+        enc.set_in_sample_rate(sample_rate)
+        enc.set_channels(channels)
+        enc.set_quality(2)
+        mp3_path.write_bytes(enc.encode(frames) + enc.flush())
+        return True
+    except Exception as e:
+        log.debug(f"in-process mp3 encode failed for {wav_path}: {e}")
+        return False
+
+
+# شکستن روی مرز جمله (علامت سوال فارسی هم پوشش داده می‌شود)
+_SENTENCE_RE = re.compile(r"(?<=[.!?؟])\s+")
+
+_VOICE_ATTRS = operator.attrgetter("id", "name", "languages", "gender")
+
 
 class Pyttsx3Engine:
     """
@@ -29,31 +101,63 @@ class Pyttsx3Engine:
     name = "pyttsx3"
 
     def __init__(self) -> None:
-        self._engine = None
+        # موتور به ازای هر thread — pyttsx3 thread-safe نیست و یک موتور مشترک
+        # همه‌ی سنتزها را پشت runAndWait سریالی می‌کند
+        self._tls = threading.local()
         self._available: bool | None = None  # None=unknown, True/False cached
+        self._voices_cache: Optional[List[Dict[str, Any]]] = None  # صداهای OS در طول عمر پروسه ثابت‌اند
+        self._valid_voice_ids: Optional[set] = None  # برای رد سریع voiceهای نامعتبر بدون سفر به driver
+        self._cache_dir = settings.AUDIO_DIR / _RESULT_CACHE_DIRNAME
+        self._cache_hits: Dict[str, int] = {}  # شمارش hit برای eviction LFU
+        # seed از محتوای دیسک — فایل‌های مانده از اجراهای قبلی هم باید کاندید
+        # eviction باشند وگرنه دایرکتوری کش بین ری‌استارت‌ها بی‌سقف رشد می‌کند
+        try:
+            for f in self._cache_dir.iterdir():
+                self._cache_hits.setdefault(f.stem, 0)
+        except OSError:
+            pass
+        self._inflight: Dict[str, asyncio.Future] = {}  # توکن idempotency به ازای کلید کش
+        # pool اختصاصی — کارهای blocking این موتور با بقیه‌ی اپ رقابت نمی‌کنند
+        self._pool = ThreadPoolExecutor(
+            max_workers=settings.TTS_THREAD_POOL_SIZE,
+            thread_name_prefix="pyttsx3",
+        )
 
     # ---- internals ----
     def _ensure_engine(self):
         if self._available is False:
             raise RuntimeError("pyttsx3 unavailable")
-        if self._engine is None:
+        eng = getattr(self._tls, "engine", None)
+        if eng is None:
             try:
-                self._engine = pyttsx3.init()
+                eng = pyttsx3.init()
+                self._tls.engine = eng
+                self._tls.count = 0
+                self._tls.lock = getattr(self._tls, "lock", None) or threading.Lock()
                 self._available = True
             except Exception as e:
                 self._available = False
                 log.error(f"pyttsx3 init failed (likely missing espeak-ng): {e}")
                 raise RuntimeError("pyttsx3 unavailable") from e
+        return eng
 
     def _list_voices_sync(self) -> List[Dict[str, Any]]:
-        self._ensure_engine()
-        voices = self._engine.getProperty("voices") or []
+        eng = self._ensure_engine()
+        voices = eng.getProperty("voices") or []
         result: List[Dict[str, Any]] = []
         for v in voices:
+            # یک unpack به جای آبشار getattr؛ fallback برای driverهای ناقص
+            try:
+                vid, vname, langs, gender = _VOICE_ATTRS(v)
+            except AttributeError:
+                vid = getattr(v, "id", None)
+                vname = getattr(v, "name", "Voice")
+                langs = getattr(v, "languages", None)
+                gender = getattr(v, "gender", "unknown")
+
             # normalize language value (bytes on some installs)
             lang = "en-US"
             try:
-                langs = getattr(v, "languages", None)
                 if langs:
                     first = langs[0]
                     if isinstance(first, (bytes, bytearray)):
@@ -63,49 +167,276 @@ class Pyttsx3Engine:
             except Exception:
                 pass
 
-            gender = getattr(v, "gender", "unknown")
-            vid = getattr(v, "id", None) or getattr(v, "name", "default")
             result.append(
                 {
-                    "id": str(vid),
-                    "name": getattr(v, "name", "Voice"),
+                    "id": str(vid or vname or "default"),
+                    "name": vname or "Voice",
                     "locale": lang,
                     "gender": str(gender).lower() if isinstance(gender, str) else "unknown",
                 }
             )
         return result
 
-    def _synthesize_sync(self, text: str, voice: str, rate_delta: int, wav_path: Path) -> Path:
-        self._ensure_engine()
-        eng = self._engine
-        # voice selection (best-effort)
-        if voice:
+    # ---- result cache ----
+    def _result_cache_key(self, text: str, voice: str, rate_delta: int, fmt: str) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update((text or "").encode("utf-8")); h.update(b"\0")
+        h.update((voice or "").encode("utf-8")); h.update(b"\0")
+        h.update(int(rate_delta).to_bytes(2, "little", signed=True))
+        h.update(fmt.encode("utf-8"))
+        return h.hexdigest()
+
+    @staticmethod
+    def _link_or_copy(src: Path, dst: Path) -> None:
+        """
+        hardlink (صفر بایت copy)؛ اگر مقصد فایل‌سیستم دیگری بود، sendfile —
+        کپی داخل کرنل، بدون عبور بایت‌ها از userland.
+        """
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+        if hasattr(os, "sendfile"):
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                remaining = os.fstat(s.fileno()).st_size
+                offset = 0
+                while remaining > 0:
+                    sent = os.sendfile(d.fileno(), s.fileno(), offset, remaining)
+                    if sent == 0:
+                        break
+                    offset += sent
+                    remaining -= sent
+        else:
+            shutil.copyfile(src, dst)
+
+    def _cache_fetch(self, key: str, fmt: str, target: Path) -> bool:
+        """
+        اگر خروجی آماده در کش بود، با hardlink (یا sendfile بین فایل‌سیستم‌ها)
+        به مقصد می‌رسد — بدون سنتز و بدون ffmpeg.
+        """
+        cached = self._cache_dir / f"{key}.{fmt}"
+        if not cached.exists():
+            return False
+        try:
+            if target.exists():
+                target.unlink()
+            self._link_or_copy(cached, target)
+        except OSError as e:
+            log.debug(f"result cache fetch failed for {key}: {e}")
+            return False
+        self._cache_hits[key] = self._cache_hits.get(key, 0) + 1
+        return True
+
+    def _cache_store(self, key: str, fmt: str, produced: Path) -> None:
+        cached = self._cache_dir / f"{key}.{fmt}"
+        try:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            if not cached.exists():
+                self._link_or_copy(produced, cached)
+            self._cache_hits.setdefault(key, 0)
+            self._evict_result_cache()
+        except OSError as e:
+            log.debug(f"result cache store failed for {key}: {e}")
+
+    def _evict_result_cache(self) -> None:
+        overflow = len(self._cache_hits) - _RESULT_CACHE_MAX_ENTRIES
+        if overflow <= 0:
+            return
+        # LFU ساده: کم‌مصرف‌ترین کلیدها حذف می‌شوند
+        victims = sorted(self._cache_hits.items(), key=lambda kv: kv[1])[:overflow]
+        for key, _ in victims:
+            self._cache_hits.pop(key, None)
+            for f in self._cache_dir.glob(f"{key}.*"):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+
+    @staticmethod
+    async def _convert_audio_async(src: Path, dst: Path) -> bool:
+        """
+        تبدیل ffmpeg به صورت async subprocess — thread worker در طول transcode
+        آزاد می‌ماند و صدها تبدیل می‌توانند هم‌زمان اجرا شوند.
+        """
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y", "-nostdin", "-loglevel", "error",
+                "-i", src.as_posix(), dst.as_posix(),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                limit=_PIPE_BUFSIZE,
+            )
+            _, err = await proc.communicate()
+            if proc.returncode != 0:
+                log.error(f"ffmpeg conversion failed {src} -> {dst}: {err.decode('utf-8', 'ignore').strip()}")
+                return False
+            return True
+        except OSError as e:
+            log.error(f"ffmpeg conversion failed {src} -> {dst}: {e}")
+            return False
+
+    def _synthesize_pipe_sync(
+        self, text: str, voice: str, rate_delta: int, fmt: str, target: Path
+    ) -> Path:
+        """
+        espeak-ng --stdout مستقیم به ffmpeg پایپ می‌شود: WAV میانی هیچ‌وقت
+        به دیسک نمی‌رسد و نه فایل موقت داریم نه read دوباره.
+        """
+        codec = "libmp3lame" if fmt == "mp3" else "libvorbis"
+        espeak_cmd = [
+            _espeak_bin(),
+            "-v", voice or "en",
+            "-s", str(_ESPEAK_BASE_WPM + int(rate_delta)),
+            "--stdout",
+        ]
+        ffmpeg_cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "wav", "-i", "pipe:0",
+            "-c:a", codec,
+            target.as_posix(),
+        ]
+        espeak = subprocess.Popen(
+            espeak_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=_PIPE_BUFSIZE
+        )
+        ffmpeg = subprocess.Popen(
+            ffmpeg_cmd, stdin=espeak.stdout, stderr=subprocess.PIPE, bufsize=_PIPE_BUFSIZE
+        )
+        espeak.stdout.close()  # تا SIGPIPE به espeak برسد اگر ffmpeg بمیرد
+        espeak.stdin.write(text.encode("utf-8"))
+        espeak.stdin.close()
+        _, ff_err = ffmpeg.communicate()
+        if espeak.wait() != 0 or ffmpeg.returncode != 0:
+            raise RuntimeError(
+                f"espeak-ng/ffmpeg pipe failed: {ff_err.decode('utf-8', 'ignore').strip()}"
+            )
+        return target
+
+    def _synthesize_espeakng_direct(self, text: str, voice: str, rate_delta: int, wav_path: Path) -> Path:
+        """
+        مسیر مستقیم espeak-ng -w: بدون لایه‌ی driver پایتونی pyttsx3 و بدون
+        main loop runAndWait — یک fork+exec و تمام. فقط روی هاست‌های espeak-ng
+        (لینوکس)؛ SAPI/NSSS همچنان از مسیر pyttsx3 می‌روند.
+        """
+        subprocess.run(
+            [
+                _espeak_bin(),
+                "-v", voice or "en",
+                "-s", str(_ESPEAK_BASE_WPM + int(rate_delta)),
+                "-w", wav_path.as_posix(),
+            ],
+            input=text, text=True, check=True, capture_output=True,
+        )
+        return wav_path
+
+    def _known_voice_ids(self) -> Optional[set]:
+        # لیست صداها یک بار خوانده و به set تبدیل می‌شود؛ None یعنی لیست
+        # در دسترس نیست و اعتبارسنجی باید best-effort بماند
+        ids = self._valid_voice_ids
+        if ids is None:
             try:
-                eng.setProperty("voice", voice)
-            except Exception as e:
-                log.warning(f"pyttsx3: could not set voice '{voice}': {e}")
+                voices = self._voices_cache or self._list_voices_sync()
+                ids = {v["id"] for v in voices}
+            except Exception:
+                return None
+            self._valid_voice_ids = ids
+        return ids
+
+    def _apply_voice_rate(self, eng, voice: str, rate_delta: int) -> None:
+        # voice selection — فقط اگر با صدای فعلی این thread فرق کند و شناسه
+        # معتبر باشد؛ یک عضویت set به جای رفت‌وبرگشت driver + exception تکراری
+        if voice and getattr(self._tls, "current_voice", None) != voice:
+            known = self._known_voice_ids()
+            if known is not None and voice not in known:
+                log.debug(f"pyttsx3: ignoring unknown voice '{voice}'")
+            else:
+                try:
+                    eng.setProperty("voice", voice)
+                    self._tls.current_voice = voice
+                except Exception as e:
+                    log.warning(f"pyttsx3: could not set voice '{voice}': {e}")
 
-        # rate adjustment (additive)
+        # rate adjustment (additive) — rate پایه یک بار per-thread خوانده می‌شود
         try:
-            base_rate = eng.getProperty("rate")
-            eng.setProperty("rate", int(base_rate) + int(rate_delta))
+            base_rate = getattr(self._tls, "base_rate", None)
+            if base_rate is None:
+                base_rate = int(eng.getProperty("rate"))
+                self._tls.base_rate = base_rate
+            desired_rate = base_rate + int(rate_delta)
+            if getattr(self._tls, "last_rate", None) != desired_rate:
+                eng.setProperty("rate", desired_rate)
+                self._tls.last_rate = desired_rate
         except Exception as e:
             log.debug(f"pyttsx3: could not adjust rate: {e}")
 
+    def _recycle_if_due(self, n: int = 1) -> None:
+        """
+        شمارش سنتزهای موتور این thread؛ بعد از _ENGINE_RECYCLE_AFTER موتور
+        متوقف و رها می‌شود تا فراخوانی بعدی lazy یک موتور تازه بسازد. قفل
+        thread-local جلوی تداخل با runAndWait در جریان را می‌گیرد.
+        """
+        lock = getattr(self._tls, "lock", None)
+        if lock is None:
+            return
+        with lock:
+            count = getattr(self._tls, "count", 0) + n
+            self._tls.count = count
+            if count < _ENGINE_RECYCLE_AFTER:
+                return
+            eng = getattr(self._tls, "engine", None)
+            if eng is not None:
+                try:
+                    eng.stop()
+                except Exception:
+                    pass
+            # state کش‌شده‌ی per-thread هم باید با موتور جدید از نو ساخته شود
+            self._tls.engine = None
+            self._tls.count = 0
+            self._tls.current_voice = None
+            self._tls.base_rate = None
+            self._tls.last_rate = None
+
+    def _synthesize_sync(self, text: str, voice: str, rate_delta: int, wav_path: Path) -> Path:
+        eng = self._ensure_engine()
+        self._apply_voice_rate(eng, voice, rate_delta)
+
         # pyttsx3 has limited/unstable pitch control across platforms -> ignored safely
 
         eng.save_to_file(text, str(wav_path))
         eng.runAndWait()
+        self._recycle_if_due()
         return wav_path
 
+    def _synthesize_many_sync(
+        self, items: List[tuple], voice: str, rate_delta: int
+    ) -> List[Path]:
+        """
+        سنتز دسته‌ای روی یک موتور: voice/rate فقط یک بار ست می‌شود، همه‌ی
+        save_to_fileها صف می‌شوند و یک runAndWait کل صف را خالی می‌کند —
+        N-1 گذار state و N-1 چرخش main loop حذف می‌شود.
+        """
+        eng = self._ensure_engine()
+        self._apply_voice_rate(eng, voice, rate_delta)
+        for text, wav_path in items:
+            eng.save_to_file(text, str(wav_path))
+        eng.runAndWait()
+        self._recycle_if_due(len(items))
+        return [wav_path for _, wav_path in items]
+
     # ---- public API (async) ----
     async def list_voices(self) -> List[Dict[str, Any]]:
+        # بعد از اولین موفقیت، بدون سفر به executor جواب می‌دهیم
+        if self._voices_cache is not None:
+            return self._voices_cache
         loop = asyncio.get_running_loop()
         try:
-            return await loop.run_in_executor(None, self._list_voices_sync)
+            voices = await loop.run_in_executor(self._pool, self._list_voices_sync)
         except Exception:
             # engine unavailable on this host
             return []
+        self._voices_cache = voices
+        self._valid_voice_ids = {v["id"] for v in voices}
+        return voices
 
     async def synthesize(
         self,
@@ -121,36 +452,292 @@ class Pyttsx3Engine:
             raise ValueError("out_path is required")
         ensure_parent_dir(out_path)
 
-        # Always render a WAV first, then convert if needed
-        wav_path = out_path if out_path.suffix.lower() == ".wav" else out_path.with_suffix(".wav")
-
+        # مقصد نهایی با پسوند فرمت خواسته‌شده + چک کش نتیجه.
+        # پسوند در سطح رشته محاسبه می‌شود — هر with_suffix یک Path جدید
+        # می‌سازد و در مسیر داغِ پاسخ‌های زیر میلی‌ثانیه در پروفایل دیده می‌شود
+        target_fmt = fmt.lower()
+        out_str = str(out_path)
+        dot = out_str.rfind(".")
+        if dot <= out_str.rfind(os.sep):
+            dot = -1  # نقطه متعلق به دایرکتوری است، نه پسوند
+        stem = out_str[:dot] if dot >= 0 else out_str
+        suffix = out_str[dot:].lower() if dot >= 0 else ""
+        final_target = out_path if suffix == "." + target_fmt else Path(stem + "." + target_fmt)
+        cache_key = self._result_cache_key(text, voice, rate, target_fmt)
         loop = asyncio.get_running_loop()
+        # I/O کش (stat/link/sendfile/eviction) روی pool اجرا می‌شود، نه روی event loop
+        if await loop.run_in_executor(
+            self._pool, self._cache_fetch, cache_key, target_fmt, final_target
+        ):
+            return final_target
+
+        # single-flight: اگر همین کلید در حال سنتز است، منتظر همان نتیجه می‌مانیم
+        existing = self._inflight.get(cache_key)
+        if existing is not None:
+            produced = await existing
+            if produced == final_target:
+                return final_target
+            # نتیجه‌ی caller اول در کش است؛ فقط link/sendfile به مقصد خودمان
+            def _deliver() -> None:
+                if not self._cache_fetch(cache_key, target_fmt, final_target):
+                    self._link_or_copy(produced, final_target)
+
+            await loop.run_in_executor(self._pool, _deliver)
+            return final_target
+
+        inflight: asyncio.Future = loop.create_future()
+        self._inflight[cache_key] = inflight
         try:
-            await loop.run_in_executor(None, self._synthesize_sync, text, voice, rate, wav_path)
-        except RuntimeError as e:
-            # bubble up cleanly so router can downgrade response
-            raise
+            target = await self._produce(text, voice, rate, target_fmt, stem, final_target, cache_key, loop)
         except Exception as e:
-            log.error(f"pyttsx3 synthesis failed: {e}", exc_info=True)
+            if not inflight.done():
+                inflight.set_exception(e)
+                inflight.exception()  # علامت‌گذاری به عنوان retrieved (بدون وارنینگ GC)
             raise
+        finally:
+            self._inflight.pop(cache_key, None)
+        if not inflight.done():
+            inflight.set_result(target)
+        return target
+
+    async def _produce(
+        self,
+        text: str,
+        voice: str,
+        rate: int,
+        target_fmt: str,
+        stem: str,
+        final_target: Path,
+        cache_key: str,
+        loop: asyncio.AbstractEventLoop,
+    ) -> Path:
+        # مسیرهای espeak-ng فقط با voice خالی یا شناسه‌ی موجود در لیست صداها؛
+        # نام‌های edge (پیش‌فرض روتر) به espeak-ng پاس دادن یعنی یک fork
+        # شکست‌خورده به ازای هر درخواست قبل از fallback
+        espeak_voice_ok = False
+        if _espeak_bin():
+            if voice:
+                known = await loop.run_in_executor(self._pool, self._known_voice_ids)
+                espeak_voice_ok = known is not None and voice in known
+            else:
+                espeak_voice_ok = True
+
+        # مسیر fused: espeak-ng → ffmpeg بدون WAV میانی روی دیسک
+        # (برای mp3 اگر lameenc نصب باشد، مسیر بدون ffmpeg پایین ارجح است)
+        use_pipe = target_fmt == "ogg" or (target_fmt == "mp3" and _lameenc_mod() is None)
+        if use_pipe and espeak_voice_ok and has_ffmpeg():
+            try:
+                await loop.run_in_executor(
+                    self._pool, self._synthesize_pipe_sync, text, voice, rate, target_fmt, final_target
+                )
+                await loop.run_in_executor(
+                    self._pool, self._cache_store, cache_key, target_fmt, final_target
+                )
+                return final_target
+            except Exception as e:
+                # fallback مورد انتظار است؛ در سطح debug تا لاگ را پر نکند
+                log.debug(f"espeak-ng pipe synthesis failed, falling back to pyttsx3: {e}")
+
+        # Always render a WAV first, then convert if needed
+        if target_fmt == "wav":
+            # مسیر متداول خروجی pyttsx3 — بدون ساخت Path اضافه و بدون چک ffmpeg
+            wav_path = final_target
+        else:
+            wav_path = Path(stem + ".wav")
+
+        rendered = False
+        if espeak_voice_ok:
+            try:
+                await loop.run_in_executor(
+                    self._pool, self._synthesize_espeakng_direct, text, voice, rate, wav_path
+                )
+                rendered = True
+            except Exception as e:
+                log.debug(f"espeak-ng direct synthesis failed, falling back to pyttsx3 driver: {e}")
+
+        if not rendered:
+            try:
+                await loop.run_in_executor(self._pool, self._synthesize_sync, text, voice, rate, wav_path)
+            except RuntimeError as e:
+                # bubble up cleanly so router can downgrade response
+                raise
+            except Exception as e:
+                log.error(f"pyttsx3 synthesis failed: {e}", exc_info=True)
+                raise
 
         # Convert if requested format is not wav
         target = wav_path
-        target_fmt = fmt.lower()
         if target_fmt in {"mp3", "ogg"}:
-            if not has_ffmpeg():
-                raise RuntimeError("ffmpeg is required to convert to the requested format.")
-            target = out_path.with_suffix(f".{target_fmt}")
-            if not convert_audio(wav_path, target):
-                raise RuntimeError("Audio conversion failed.")
+            target = final_target
+            # mp3: انکود داخل پروسه با LAME اگر موجود باشد — بدون fork
+            converted = False
+            if target_fmt == "mp3" and _lameenc_mod() is not None:
+                converted = await loop.run_in_executor(
+                    self._pool, _wav_to_mp3_inproc, wav_path, target
+                )
+            if not converted:
+                if not has_ffmpeg():
+                    raise RuntimeError("ffmpeg is required to convert to the requested format.")
+                if not await self._convert_audio_async(wav_path, target):
+                    raise RuntimeError("Audio conversion failed.")
 
             # if conversion succeeded and the target is different, you may keep wav for cache or remove it.
             # We keep wav by default; remove if you want to save disk space:
             # try: wav_path.unlink()
             # except Exception: pass
 
+        await loop.run_in_executor(self._pool, self._cache_store, cache_key, target_fmt, target)
         return target
 
+    async def synthesize_stream(
+        self, text: str, voice: str = "", rate: int = 0
+    ) -> AsyncIterator[bytes]:
+        """
+        سنتز تکه‌تکه: متن روی مرز جمله شکسته می‌شود، جمله‌ها موازی در pool
+        رندر می‌شوند و بایت‌های WAV هر جمله به محض آماده شدن (به ترتیب ارسال)
+        yield می‌شوند — پخش می‌تواند بعد از جمله‌ی اول شروع شود.
+        """
+        sentences = [s for s in _SENTENCE_RE.split(text or "") if s.strip()]
+        if not sentences:
+            return
+        loop = asyncio.get_running_loop()
+        with tempfile.TemporaryDirectory(prefix="tts-stream-") as td:
+            futures = [
+                loop.run_in_executor(
+                    self._pool, self._synthesize_sync, sentence, voice, rate, Path(td) / f"{i}.wav"
+                )
+                for i, sentence in enumerate(sentences)
+            ]
+            for fut in futures:
+                wav_path = await fut
+                yield wav_path.read_bytes()
+                try:
+                    wav_path.unlink()
+                except OSError:
+                    pass
+
+    async def synthesize_to_stream(
+        self, text: str, voice: str = "", rate: int = 0, fmt: str = "wav"
+    ) -> AsyncIterator[bytes]:
+        """
+        سنتز مستقیم به جریان HTTP بدون لمس دیسک: espeak-ng --stdout و برای
+        فرمت‌های غیر WAV یک ffmpeg که از همان pipe کرنلی می‌خواند. بایت‌ها در
+        تکه‌های ۶۴KB به محض تولید yield می‌شوند — نه فایل موقتی، نه read دوم،
+        و مصرف حافظه به اندازه‌ی همان یک تکه محدود است.
+        """
+        if not _espeak_bin():
+            raise RuntimeError("espeak-ng is required for streaming synthesis.")
+        fmt = fmt.lower()
+        if fmt != "wav" and not has_ffmpeg():
+            raise RuntimeError("ffmpeg is required to stream non-WAV formats.")
+
+        # voice باید برای espeak-ng معنا داشته باشد؛ نام ناشناخته (مثل پیش‌فرض
+        # edge در روتر) به جای exit 1 و بدنه‌ی خالی به صدای پیش‌فرض map می‌شود
+        if voice:
+            loop = asyncio.get_running_loop()
+            known = await loop.run_in_executor(self._pool, self._known_voice_ids)
+            if known is None or voice not in known:
+                voice = ""
+
+        espeak_cmd = [
+            _espeak_bin(),
+            "-v", voice or "en",
+            "-s", str(_ESPEAK_BASE_WPM + int(rate)),
+            "--stdout",
+        ]
+        procs: List[asyncio.subprocess.Process] = []
+        if fmt == "wav":
+            espeak = await asyncio.create_subprocess_exec(
+                *espeak_cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                limit=_PIPE_BUFSIZE,
+            )
+            procs.append(espeak)
+            reader = espeak.stdout
+        else:
+            # اتصال stdout→stdin با pipe سیستم‌عامل؛ WAV میانی از userland عبور نمی‌کند
+            read_fd, write_fd = os.pipe()
+            espeak = await asyncio.create_subprocess_exec(
+                *espeak_cmd, stdin=asyncio.subprocess.PIPE, stdout=write_fd
+            )
+            os.close(write_fd)
+            codec = "libmp3lame" if fmt == "mp3" else "libvorbis"
+            ffmpeg = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-loglevel", "error",
+                "-f", "wav", "-i", "pipe:0",
+                "-c:a", codec, "-f", fmt, "pipe:1",
+                stdin=read_fd,
+                stdout=asyncio.subprocess.PIPE,
+                limit=_PIPE_BUFSIZE,
+            )
+            os.close(read_fd)
+            procs.extend((espeak, ffmpeg))
+            reader = ffmpeg.stdout
+
+        async def _feed() -> None:
+            try:
+                espeak.stdin.write(text.encode("utf-8"))
+                await espeak.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                espeak.stdin.close()
+
+        feeder = asyncio.ensure_future(_feed())
+        try:
+            total = 0
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                total += len(chunk)
+                yield chunk
+            # exit code چک می‌شود — EOF فوری با exit غیرصفر یعنی سنتز شکست
+            # خورده و نباید ساکت یک پاسخ خالی برگردد
+            returncodes = await asyncio.gather(*(p.wait() for p in procs))
+            if any(rc != 0 for rc in returncodes):
+                if total == 0:
+                    raise RuntimeError("streaming synthesis failed (espeak-ng/ffmpeg exited with an error).")
+                log.warning(f"streaming synthesis exited nonzero after {total} bytes: {returncodes}")
+        finally:
+            feeder.cancel()
+            for p in procs:
+                if p.returncode is None:
+                    p.kill()
+
+    async def synthesize_many(
+        self, items: List[tuple], fmt: str = "wav"
+    ) -> List[Path]:
+        """
+        API دسته‌ای برای رندر تعداد زیادی متن کوتاه (کاتالوگ UI، پاراگراف‌های
+        یک کتاب). هر آیتم (text, voice, rate, out_path) است؛ آیتم‌ها بر اساس
+        (voice, rate) گروه می‌شوند و هر گروه در یک جلسه‌ی موتور سنتز می‌شود.
+        خروجی WAV است؛ ترتیب لیست برگشتی با ورودی یکی است.
+        """
+        loop = asyncio.get_running_loop()
+        groups: Dict[tuple, List[tuple]] = {}
+        for text, voice, rate, out_path in items:
+            ensure_parent_dir(out_path)
+            groups.setdefault((voice or "", int(rate)), []).append((text, out_path))
+        futures = [
+            loop.run_in_executor(self._pool, self._synthesize_many_sync, batch, v, r)
+            for (v, r), batch in groups.items()
+        ]
+        if futures:
+            await asyncio.gather(*futures)
+        return [out_path for _, _, _, out_path in items]
+
+    async def aclose(self) -> None:
+        # آزادسازی threadها در shutdown
+        self._pool.shutdown(wait=False)
+
     async def get_duration(self, path: Path) -> float:
-        dur = probe_duration_seconds(path)
+        # اول sidecar (یک read کوچک JSON، بدون subprocess)؛ اگر نبود probe
+        # در pool اجرا می‌شود تا event loop بلاک نشود و نتیجه ذخیره می‌شود
+        dur = read_duration_sidecar(path)
+        if dur is None:
+            loop = asyncio.get_running_loop()
+            dur = await loop.run_in_executor(self._pool, probe_duration_seconds, path)
+            write_duration_sidecar(path, dur)
         return dur or 0.0